@@ -0,0 +1,151 @@
+"""Benchmarks the processing pipeline on synthetic Connector Hub payloads.
+
+Usage: python benchmark.py [--resources N] [--metrics N] [--datapoints N] [--repeat N] [--workers N]
+"""
+import argparse
+import gzip
+import logging
+import os
+import time
+from typing import Callable, Dict, List, Tuple
+
+os.environ.setdefault("IMPORT_ALL_METRICS", "False")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+# Nothing is sent, the destination is only needed to create the metric sink
+os.environ.setdefault("DYNATRACE_TENANT", "https://benchmark.invalid")
+os.environ.setdefault("AUTH_METHOD", "token")
+os.environ.setdefault("DYNATRACE_API_KEY", "benchmark")
+
+import parallel
+from dynatrace_client import DynatraceClient
+from func import process_events, process_metrics
+from metric_point import MetricPoint
+from sink import MintSink
+
+COMPUTE_METRICS = [
+    "CpuUtilization",
+    "DiskBytesRead",
+    "DiskBytesWritten",
+    "DiskIopsRead",
+    "DiskIopsWritten",
+    "LoadAverage",
+    "MemoryAllocationStalls",
+    "MemoryUtilization",
+    "NetworksBytesIn",
+    "NetworksBytesOut",
+]
+# Recent enough to pass the pre-ingest timestamp validation
+START_TIMESTAMP_MS = (int(time.time()) // 60 - 30) * 60 * 1000
+BENCHMARK_SETTINGS = [
+    {"IMPORT_ALL_METRICS": "False", "IMPORT_ALL_DIMENSIONS": "False"},
+    {"IMPORT_ALL_METRICS": "True", "IMPORT_ALL_DIMENSIONS": "False"},
+    {"IMPORT_ALL_METRICS": "True", "IMPORT_ALL_DIMENSIONS": "True"},
+]
+
+
+# Builds one CloudEvent per resource and metric, each carrying a datapoint every 20 seconds
+def synthetic_events(resources: int, metrics: int, datapoints: int) -> List[Dict]:
+    events = []
+    for resource in range(resources):
+        for metric in range(metrics):
+            events.append({
+                "namespace": "oci_computeagent",
+                "name": COMPUTE_METRICS[metric % len(COMPUTE_METRICS)],
+                "compartmentId": f"ocid1.compartment.oc1..{resource % 8:060d}",
+                "resourceGroup": None,
+                "dimensions": {
+                    "availabilityDomain": f"AD-{resource % 3 + 1}",
+                    "faultDomain": f"FAULT-DOMAIN-{resource % 3 + 1}",
+                    "imageId": "ocid1.image.oc1.iad.aaaaaaaabbbbbbbbccccccccddddddddeeeeeeeeffffffffgggggggg",
+                    "region": "us-ashburn-1",
+                    "resourceDisplayName": f"instance-{resource:05d}",
+                    "resourceId": f"ocid1.instance.oc1.iad.{resource:060d}",
+                },
+                "datapoints": [
+                    {"timestamp": START_TIMESTAMP_MS + i * 20_000, "value": float((resource + i) % 100)}
+                    for i in range(datapoints)
+                ],
+            })
+    return events
+
+
+def timed(function: Callable, repeat: int) -> Tuple[object, float]:
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def process(events: List[Dict]) -> List[MetricPoint]:
+    points = []
+    for event in events:
+        points.extend(process_metrics(event))
+    return points
+
+
+def report(name: str, count: int, seconds: float, payload: bytes = None):
+    line = f"{name:<28} {seconds * 1000:9.1f} ms  {count / seconds:12,.0f} points/s"
+    if payload is not None:
+        line += f"  {len(payload):12,d} bytes  {len(gzip.compress(payload)):10,d} gzipped"
+    print(line)
+
+
+def bench_sinks(points: List[MetricPoint], repeat: int):
+    mint_sink = MintSink(DynatraceClient())
+    payload, seconds = timed(lambda: "\n".join(mint_sink.serialize(points)).encode("utf-8"), repeat)
+    report("serialize mint", len(points), seconds, payload)
+
+    try:
+        from otlp import OtlpSink, SUMMARY_MODE_GAUGE, SUMMARY_MODE_SUMMARY
+    except ImportError as e:
+        print(f"Skipping OTLP benchmark: {e}")
+        return
+    for summary_mode in (SUMMARY_MODE_GAUGE, SUMMARY_MODE_SUMMARY):
+        otlp_sink = OtlpSink(DynatraceClient(), summary_mode)
+        payload, seconds = timed(lambda: otlp_sink.serialize(points), repeat)
+        report(f"serialize otlp ({summary_mode})", len(points), seconds, payload)
+
+
+# The pool is started before timing so only the steady state of a warm container is measured
+def bench_workers(events: List[Dict], max_workers: int, repeat: int):
+    os.environ["PARALLEL_EVENT_THRESHOLD"] = "0"
+    baseline = None
+    for workers in range(1, max_workers + 1):
+        os.environ["PARALLEL_WORKERS"] = str(workers)
+        process_events(events[:workers])
+        serialized, seconds = timed(lambda: process_events(events), repeat)
+        baseline = baseline or seconds
+        report(f"{workers} worker(s), {baseline / seconds:4.1f}x", len(serialized), seconds)
+    parallel.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--resources", type=int, default=500)
+    parser.add_argument("--metrics", type=int, default=10)
+    parser.add_argument("--datapoints", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(os.environ["LOG_LEVEL"])
+
+    events = synthetic_events(args.resources, args.metrics, args.datapoints)
+    print(f"{len(events):,d} events, {len(events) * args.datapoints:,d} raw datapoints")
+
+    for settings in BENCHMARK_SETTINGS:
+        os.environ.update(settings)
+        print("\n" + " ".join(f"{key}={value}" for key, value in settings.items()))
+        points, seconds = timed(lambda: process(events), args.repeat)
+        report("map and aggregate", len(points), seconds)
+        bench_sinks(points, args.repeat)
+
+    print(f"\nMap, aggregate and serialize (mint) with 1 to {args.workers} worker processes")
+    os.environ.update(BENCHMARK_SETTINGS[0])
+    bench_workers(events, args.workers, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,70 @@
 from abc import abstractmethod, ABC
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 import logging
+import re
 import time
-from typing import Dict
+from typing import Callable, Dict, List, Optional, Set, Tuple
 import requests
 from mint import MintMetric
+from quarantine import QuarantineCache, line_series
 
 METRIC_INGEST_ENDPOINT = "/api/v2/metrics/ingest"
+OTLP_METRICS_ENDPOINT = "/api/v2/otlp/v1/metrics"
 OAUTH_TOKEN_ENDPOINT = "/sso/oauth2/token"
 
+# Keep every request comfortably below the ingest API's payload limit
+MAX_LINES_PER_REQUEST = 1000
+MAX_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 1
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Errors about a single datapoint rather than its series, such as a timestamp outside of the accepted window
+# when the clock differs from the tenant's. The series is still healthy and is not quarantined.
+_DATAPOINT_ERROR = re.compile(r"timestamp|(?<!dimension )value|payload|\bnan\b|infinit", re.IGNORECASE)
+
+
 class BaseClient(ABC):
+    def __init__(self, tenant: str):
+        self._tenant = tenant
+
+    # Authorization headers, proxies are the ones used for the ingest request so any token request goes the same way
     @abstractmethod
-    def send_mint_metric(self, mint_metric: MintMetric, proxies: Dict[str, str]):
+    def headers(self, proxies: Optional[Dict[str, str]] = None) -> Dict[str, str]:
         pass
 
+    # Sends a payload of one or more newline separated MINT lines. Returns the ingest API's response,
+    # or None if the request could not be sent.
+    def send_mint_metric(self, payload: str, proxies: Dict[str, str]) -> Optional[requests.Response]:
+        return self.post(METRIC_INGEST_ENDPOINT, payload.encode("utf-8"), "text/plain; charset=utf-8", proxies)
+
+    # Sends a serialized OTLP ExportMetricsServiceRequest. Returns True if the ingest API accepted it.
+    def send_otlp_metrics(self, payload: bytes, proxies: Dict[str, str]) -> bool:
+        response = self.post(OTLP_METRICS_ENDPOINT, payload, "application/x-protobuf", proxies)
+        return response is not None and response.ok
+
+    # Retries on connection errors and retryable status codes
+    def post(self, endpoint: str, payload: bytes, content_type: str, proxies: Dict[str, str]) -> Optional[requests.Response]:
+        tenant_url = f"{self._tenant}{endpoint}"
+        for attempt in range(1, MAX_RETRIES + 1):
+            try:
+                headers = {**self.headers(proxies), "Content-Type": content_type}
+                response = requests.post(tenant_url, data=payload, headers=headers, proxies=proxies, timeout=15)
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    logging.getLogger().info(response.text)
+                    return response
+                logging.getLogger().warning(
+                    f"Ingest to '{self._tenant}' returned {response.status_code} (attempt {attempt}/{MAX_RETRIES}): {response.text}"
+                )
+            except Exception as e:
+                logging.getLogger().error(f"Error sending metrics to '{self._tenant}' (attempt {attempt}/{MAX_RETRIES}): {e}")
+            if attempt < MAX_RETRIES:
+                time.sleep(RETRY_BACKOFF_SECONDS * attempt)
+        return None
+
 
 class OAuthClient(BaseClient):
     def __init__(self, tenant: str, client_id: str, client_secret: str, urn: str):
-        self._tenant = tenant
+        super().__init__(tenant)
         self._client_id = client_id
         self._client_secret = client_secret
         self._urn = urn
@@ -24,9 +72,9 @@ class OAuthClient(BaseClient):
         self._access_token = None
 
     def is_expired(self):
-        return self._expiration == -1 or self._expiration >= time.time()
+        return self._expiration == -1 or self._expiration <= time.time()
 
-    def refresh_token(self):
+    def refresh_token(self, proxies: Optional[Dict[str, str]] = None):
         if self._access_token is None or self.is_expired():
             headers = {"Content-Type": "application/x-www-form-urlencoded"}
             data = {
@@ -37,7 +85,7 @@ class OAuthClient(BaseClient):
                 "scope": "storage:metrics:write",
             }
             response = requests.post(
-                "https://sso.dynatrace.com/sso/oauth2/token", data=data, headers=headers
+                "https://sso.dynatrace.com/sso/oauth2/token", data=data, headers=headers, proxies=proxies, timeout=15
             )
             if response.status_code == 200:
                 json = response.json()
@@ -48,49 +96,181 @@ class OAuthClient(BaseClient):
                     f"Could not authentication using OAuth: {response.text}"
                 )
 
-    def send_mint_metric(self, mint_metric: MintMetric, proxies: Dict[str, str]):
-        self.refresh_token()
-        try:
-            tenant_url = f"{self._tenant}{METRIC_INGEST_ENDPOINT}"
-            headers = {
-                "Content-Type": "text/plain",
-                "Authorization": f"Bearer {self._access_token}",
-            }
-            response = requests.post(tenant_url, data=str(mint_metric), headers=headers, proxies=proxies, timeout=15)
-            logging.getLogger().info(response.json())
-        except Exception as e:
-            logging.getLogger().error(f"Error sending mint metric: {e}")
+    def headers(self, proxies: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        self.refresh_token(proxies)
+        return {"Authorization": f"Bearer {self._access_token}"}
 
 
 class ApiClient(BaseClient):
     def __init__(self, tenant: str, api_token: str):
-        self._tenant = tenant
+        super().__init__(tenant)
         self._api_token = api_token
 
-    def send_mint_metric(self, mint_metric: MintMetric, proxies: Dict[str, str]):
-        try:
-            tenant_url = f"{self._tenant}{METRIC_INGEST_ENDPOINT}"
-            headers = {
-                "Content-Type": "text/plain",
-                "Authorization": f"Api-Token {self._api_token}",
-            }
-            response = requests.post(tenant_url, data=str(mint_metric), headers=headers, proxies=proxies, timeout=15)
-            logging.getLogger().info(response.text)
-        except Exception as e:
-            logging.getLogger().error(f"Error sending mint metric: {e}")
+    def headers(self, proxies: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        return {"Authorization": f"Api-Token {self._api_token}"}
+
+
+def chunk_mint_lines(lines: List[str], max_lines: int = MAX_LINES_PER_REQUEST) -> List[str]:
+    return ["\n".join(lines[i:i + max_lines]) for i in range(0, len(lines), max_lines)]
+
+
+# Returns the 1-based line numbers and errors of the lines the ingest API rejected
+def parse_invalid_lines(response: requests.Response) -> List[Tuple[int, str]]:
+    if response.status_code != 400:
+        return []
+    try:
+        error = response.json().get("error") or {}
+    except ValueError:
+        return []
+    return [
+        (invalid_line["line"], invalid_line.get("error", ""))
+        for invalid_line in error.get("invalidLines") or []
+        if isinstance(invalid_line.get("line"), int)
+    ]
+
+
+# Whether a rejection describes the series itself (metric key, type conflict, dimensions)
+def is_series_error(error: str) -> bool:
+    return not _DATAPOINT_ERROR.search(error or "")
+
+
+@dataclass
+class Destination:
+    name: str
+    client: BaseClient
+    proxies: Optional[Dict[str, str]] = None
+    # Metric key prefixes this destination accepts, an empty list accepts every metric
+    metric_filter: List[str] = field(default_factory=list)
+    # Series this destination rejected are not sent to it again until their quarantine expires
+    quarantine: Optional[QuarantineCache] = None
+
+    def accepts(self, line: str) -> bool:
+        return not self.metric_filter or line.startswith(tuple(self.metric_filter))
+
+    def send(self, lines: List[str], payloads: List[str]) -> bool:
+        # Lines serialized before a series was quarantined, for example by a worker process, are removed here
+        check_quarantine = self.quarantine is not None and self.quarantine.has_entries(self.name)
+        # Series whose quarantine expired, they are sent again and cleared if the destination accepts them
+        probes = set()
+        if self.metric_filter or check_quarantine:
+            lines = [line for line in lines if self.accepts(line) and not (check_quarantine and self._is_quarantined(line, probes))]
+            payloads = chunk_mint_lines(lines)
+        success = True
+        for index, payload in enumerate(payloads):
+            response = self.client.send_mint_metric(payload, self.proxies)
+            if response is None:
+                success = False
+                continue
+            chunk = lines[index * MAX_LINES_PER_REQUEST:(index + 1) * MAX_LINES_PER_REQUEST]
+            invalid_lines = parse_invalid_lines(response)
+            if invalid_lines:
+                self._quarantine_invalid_lines(chunk, invalid_lines)
+            # Valid lines of a request with invalid lines are still ingested
+            accepted = response.ok or bool(invalid_lines)
+            if probes and accepted:
+                self._clear_accepted_probes(chunk, invalid_lines, probes)
+            success = success and accepted
+        return success
+
+    def _is_quarantined(self, line: str, probes: Set[str]) -> bool:
+        series = line_series(line)
+        if self.quarantine.is_quarantined(self.name, series):
+            return True
+        if (self.name, series) in self.quarantine:
+            probes.add(series)
+        return False
+
+    def _clear_accepted_probes(self, chunk: List[str], invalid_lines: List[Tuple[int, str]], probes: Set[str]):
+        rejected = {line_series(chunk[number - 1]) for number, _ in invalid_lines if 0 < number <= len(chunk)}
+        accepted = {series for series in map(line_series, chunk) if series in probes and series not in rejected}
+        if accepted:
+            self.quarantine.clear(self.name, accepted)
+            logging.getLogger().info(f"Destination '{self.name}' accepted {len(accepted)} previously quarantined series")
+
+    def _quarantine_invalid_lines(self, chunk: List[str], invalid_lines: List[Tuple[int, str]]):
+        logging.getLogger().warning(
+            f"Destination '{self.name}' rejected {len(invalid_lines)} lines, first error: {invalid_lines[0][1]}"
+        )
+        if self.quarantine is None:
+            return
+        series = {
+            line_series(chunk[number - 1]) for number, error in invalid_lines
+            if 0 < number <= len(chunk) and is_series_error(error)
+        }
+        if series:
+            self.quarantine.add(self.name, series)
+            logging.getLogger().warning(f"Quarantined {len(series)} series for destination '{self.name}'")
 
 
 class DynatraceClient:
-    def __init__(self, tenant: str):
+    def __init__(self, tenant: Optional[str] = None, quarantine: Optional[QuarantineCache] = None):
         self._tenant = tenant
+        self._destinations: List[Destination] = []
+        self.quarantine = quarantine
 
-    def using_oauth(self, client_id: str, client_secret: str, urn: str):
-        self._client = OAuthClient(self._tenant, client_id, client_secret, urn)
-        return self
+    @property
+    def destinations(self) -> List[Destination]:
+        return self._destinations
 
-    def using_api_token(self, api_token: str):
-        self._client = ApiClient(self._tenant, api_token)
+    def add_destination(self, destination: Destination):
+        if self.quarantine is not None and destination.quarantine is None:
+            destination.quarantine = self.quarantine
+            self.quarantine.register_destination(destination.name)
+        self._destinations.append(destination)
         return self
 
-    def send_mint_metric(self, mint_metric: MintMetric, proxies: Dict[str, str]):
-        self._client.send_mint_metric(mint_metric, proxies)
\ No newline at end of file
+    def using_oauth(
+        self,
+        client_id: str,
+        client_secret: str,
+        urn: str,
+        proxies: Optional[Dict[str, str]] = None,
+        metric_filter: Optional[List[str]] = None,
+    ):
+        client = OAuthClient(self._tenant, client_id, client_secret, urn)
+        return self.add_destination(Destination(self._tenant, client, proxies, metric_filter or []))
+
+    def using_api_token(
+        self,
+        api_token: str,
+        proxies: Optional[Dict[str, str]] = None,
+        metric_filter: Optional[List[str]] = None,
+    ):
+        client = ApiClient(self._tenant, api_token)
+        return self.add_destination(Destination(self._tenant, client, proxies, metric_filter or []))
+
+    # Serializes the batch once and sends it to every destination concurrently.
+    # Returns a map of destination name to whether every payload was accepted.
+    def send_mint_lines(self, lines: List[MintMetric]) -> Dict[str, bool]:
+        if not lines:
+            return {}
+        payloads = chunk_mint_lines(lines)
+        return self.fan_out(lambda destination: destination.send(lines, payloads))
+
+    # Runs send for every destination concurrently, isolating failures of one destination from the others
+    def fan_out(self, send: Callable[[Destination], bool]) -> Dict[str, bool]:
+        if not self._destinations:
+            return {}
+        if len(self._destinations) == 1:
+            destination = self._destinations[0]
+            results = {destination.name: self._send_isolated(send, destination)}
+        else:
+            with ThreadPoolExecutor(max_workers=len(self._destinations)) as executor:
+                futures = [
+                    (destination.name, executor.submit(self._send_isolated, send, destination))
+                    for destination in self._destinations
+                ]
+                results = {name: future.result() for name, future in futures}
+
+        for name, success in results.items():
+            if not success:
+                logging.getLogger().error(f"Failed to send metrics to destination '{name}'")
+        return results
+
+    @staticmethod
+    def _send_isolated(send: Callable[[Destination], bool], destination: Destination) -> bool:
+        try:
+            return send(destination)
+        except Exception as e:
+            logging.getLogger().error(f"Error sending metrics to destination '{destination.name}': {e}")
+            return False
@@ -0,0 +1,201 @@
+from abc import abstractmethod, ABC
+from collections import OrderedDict
+import json
+import logging
+import re
+import threading
+import time
+from typing import Dict, Iterable, Mapping, Optional, Set
+
+# OCI dimensions holding an OCID and the Dynatrace dimension their display name is added as
+ENRICHED_DIMENSIONS = {
+    "compartmentId": "oci.compartment_name",
+    "resourceId": "oci.resource_name",
+    "resourceTenantId": "oci.tenancy_name",
+}
+
+_OCID = re.compile(r"^ocid1\.[a-z0-9_-]+\.[a-z0-9_-]*\.[a-z0-9_-]*\.[a-z0-9_.-]+$")
+
+
+def is_ocid(value) -> bool:
+    return isinstance(value, str) and _OCID.match(value) is not None
+
+
+class NameResolver(ABC):
+    # Resolves the display names of the OCIDs in a single lookup, unknown OCIDs map to None
+    @abstractmethod
+    def resolve(self, ocids: Set[str]) -> Dict[str, Optional[str]]:
+        pass
+
+
+class StaticNameResolver(NameResolver):
+    def __init__(self, names: Dict[str, str]):
+        self._names = names
+
+    # The file contains a JSON object mapping OCIDs to names
+    # Ex: {"ocid1.compartment.oc1..aaaa": "production"}
+    @classmethod
+    def from_file(cls, path: str) -> "StaticNameResolver":
+        with open(path, "r", encoding="utf-8") as file:
+            return cls(json.load(file))
+
+    def resolve(self, ocids: Set[str]) -> Dict[str, Optional[str]]:
+        return {ocid: self._names.get(ocid) for ocid in ocids}
+
+
+class OciSearchResolver(NameResolver):
+    # Keep each structured query well below the search API's query length limit
+    MAX_OCIDS_PER_QUERY = 100
+
+    def __init__(self):
+        # The OCI SDK is only needed for this resolver, add `oci` to requirements.txt to use it
+        import oci
+
+        self._oci = oci
+        signer = oci.auth.signers.get_resource_principals_signer()
+        self._client = oci.resource_search.ResourceSearchClient(config={}, signer=signer)
+
+    def resolve(self, ocids: Set[str]) -> Dict[str, Optional[str]]:
+        names: Dict[str, Optional[str]] = {ocid: None for ocid in ocids}
+        # Only values that look like OCIDs end up in the query, anything else cannot be resolved anyway
+        valid_ocids = sorted(ocid for ocid in ocids if is_ocid(ocid))
+        for i in range(0, len(valid_ocids), self.MAX_OCIDS_PER_QUERY):
+            chunk = valid_ocids[i:i + self.MAX_OCIDS_PER_QUERY]
+            query = "query all resources where " + " || ".join(f"identifier = '{ocid}'" for ocid in chunk)
+            details = self._oci.resource_search.models.StructuredSearchDetails(
+                query=query, type="Structured", matching_context_type="NONE"
+            )
+            response = self._oci.pagination.list_call_get_all_results(self._client.search_resources, details)
+            for resource in response.data:
+                names[resource.identifier] = resource.display_name
+        return names
+
+
+class NameCache:
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 3600, negative_ttl_seconds: float = 300):
+        self._max_size = max_size
+        self._ttl_seconds = ttl_seconds
+        self._negative_ttl_seconds = negative_ttl_seconds
+        # ocid -> (name or None, expiration)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    # Returns a tuple of (found, name), a found entry can have a None name when the OCID is known not to resolve.
+    # Lookups are only counted in the statistics when record_stats is set.
+    def get(self, ocid: str, record_stats: bool = True) -> tuple:
+        with self._lock:
+            entry = self._entries.get(ocid)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[ocid]
+                if record_stats:
+                    self.misses += 1
+                return False, None
+            self._entries.move_to_end(ocid)
+            if record_stats:
+                if entry[0] is None:
+                    self.negative_hits += 1
+                else:
+                    self.hits += 1
+            return True, entry[0]
+
+    def put_all(self, names: Dict[str, Optional[str]]):
+        now = time.monotonic()
+        with self._lock:
+            for ocid, name in names.items():
+                ttl = self._ttl_seconds if name is not None else self._negative_ttl_seconds
+                self._entries[ocid] = (name, now + ttl)
+                self._entries.move_to_end(ocid)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+            }
+
+
+class Enricher:
+    def __init__(self, resolver: NameResolver, cache: Optional[NameCache] = None):
+        self._resolver = resolver
+        self.cache = cache or NameCache()
+
+    # Resolves every OCID of the batch that is not cached yet with a single resolver call.
+    # The cache statistics count each distinct OCID of a batch once.
+    def prefetch(self, events: Iterable[Dict]):
+        unknown = {ocid for ocid in _event_ocids(events) if not self.cache.get(ocid)[0]}
+        if unknown:
+            self._resolve(unknown)
+
+    # The cached names of the OCIDs in the events, used to hand a prefetched batch to worker processes
+    def cached_names(self, events: Iterable[Dict]) -> Dict[str, Optional[str]]:
+        names = {}
+        for ocid in _event_ocids(events):
+            found, name = self.cache.get(ocid, record_stats=False)
+            if found:
+                names[ocid] = name
+        return names
+
+    # Returns the name dimensions for the OCIDs in oci_dimensions. Only the cache is used, so the resolver
+    # is never called per event; OCIDs missing from the cache are resolved by the next prefetch.
+    def enrich(self, oci_dimensions: Dict[str, str]) -> Dict[str, str]:
+        enriched = {}
+        for oci_key, dynatrace_key in ENRICHED_DIMENSIONS.items():
+            ocid = oci_dimensions.get(oci_key)
+            if not is_ocid(ocid):
+                continue
+            found, name = self.cache.get(ocid, record_stats=False)
+            if found and name is not None:
+                enriched[dynatrace_key] = name
+        return enriched
+
+    def _resolve(self, ocids: Set[str]):
+        try:
+            names = self._resolver.resolve(ocids)
+        except Exception as e:
+            # Failures are not cached so the next invocation tries again
+            logging.getLogger().error(f"Could not resolve names for {len(ocids)} OCIDs: {e}")
+            return
+        self.cache.put_all(names)
+
+
+def _event_ocids(events: Iterable[Dict]) -> Set[str]:
+    ocids: Set[str] = set()
+    for event in events:
+        if not isinstance(event, dict):
+            continue
+        dimensions = event.get("dimensions") or {}
+        if not isinstance(dimensions, dict):
+            continue
+        for oci_key in ENRICHED_DIMENSIONS:
+            # Values that are not OCIDs, including non-strings of malformed events, cannot be resolved
+            if is_ocid(ocid := event.get(oci_key) or dimensions.get(oci_key)):
+                ocids.add(ocid)
+    return ocids
+
+
+def create_enricher(settings: Mapping[str, str]) -> Optional[Enricher]:
+    resolver_type = settings.get("ENRICHMENT_RESOLVER", "none").lower()
+    if resolver_type == "none":
+        return None
+    if resolver_type == "static":
+        resolver: NameResolver = StaticNameResolver.from_file(settings["ENRICHMENT_FILE"])
+    elif resolver_type == "oci":
+        resolver = OciSearchResolver()
+    else:
+        raise ValueError(f"Invalid enrichment resolver '{resolver_type}'. Expected 'none', 'static' or 'oci'")
+    cache = NameCache(
+        int(settings.get("ENRICHMENT_CACHE_SIZE", "10000")),
+        float(settings.get("ENRICHMENT_TTL_SECONDS", "3600")),
+        float(settings.get("ENRICHMENT_NEGATIVE_TTL_SECONDS", "300")),
+    )
+    return Enricher(resolver, cache)
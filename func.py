@@ -2,23 +2,52 @@ import io
 import os
 import json
 import logging
-from typing import Dict, Optional
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Mapping, Optional
 from aggregation import create_minutely_buckets
-from dynatrace_client import DynatraceClient
-from mint import MintMetric
+from enrichment import Enricher, create_enricher
+from dynatrace_client import ApiClient, Destination, DynatraceClient, OAuthClient
+from metric_point import MetricPoint
+from sink import MetricSink, MintSink
 from summary_stat import SummaryStat
 from metric_mapping import namespace_map
+import parallel
+from normalization import normalize_dimension_key, normalize_metric_key
+from quarantine import QuarantineCache
+from validation import validate_points
 from urllib.parse import quote
 import requests
 
 
-def process_metrics(body: Dict):
+# When enabled, metrics imported with IMPORT_ALL_METRICS keep every OCI dimension instead of only the
+# resource group and compartment
+def import_all_dimensions() -> bool:
+    return os.environ.get("IMPORT_ALL_DIMENSIONS", "false").lower() == "true"
+
+
+# The enricher and its name cache are kept for the lifetime of the container
+_enricher: Optional[Enricher] = None
+_enricher_created = False
+
+
+def get_enricher() -> Optional[Enricher]:
+    global _enricher, _enricher_created
+    if not _enricher_created:
+        _enricher = create_enricher(os.environ)
+        _enricher_created = True
+    return _enricher
+
+
+# Maps and aggregates a single CloudEvent into metric points, serializing and sending is left to the
+# caller so the whole invocation can be pushed as one batch
+def process_metrics(body: Dict) -> List[MetricPoint]:
     logging.getLogger().info(f"process_metrics: {body}")
 
     namespace = body.get("namespace")
     metric_name = body.get("name")
 
-    oci_dimensions: Dict[str, str] = body.get("dimensions", {})
+    # Copied so the event is left untouched for callers that process it again
+    oci_dimensions: Dict[str, str] = dict(body.get("dimensions", {}))
 
     # Include the resourceGroup and compartmentId in oci_dimensions so they can be mapped using the dimension_mapping
     oci_dimensions["resourceGroup"] = body.get("resourceGroup")
@@ -29,9 +58,23 @@ def process_metrics(body: Dict):
     import_all_metrics = True if os.environ["IMPORT_ALL_METRICS"].lower() == "true" else False
     logging.getLogger().info(f"import_all_metrics: {import_all_metrics}")
 
+    metric_points: List[MetricPoint] = []
+
     if import_all_metrics:
-        key_namespace = namespace.replace("oci_", "")
-        key = f"cloud.oci.{key_namespace}.{metric_name}"
+        key = normalize_metric_key(namespace, metric_name)
+        if import_all_dimensions():
+            dimensions = {
+                normalize_dimension_key(oci_key): value
+                for oci_key, value in oci_dimensions.items()
+                if value is not None
+            }
+        else:
+            dimensions = {
+                "oci.resource_group": oci_dimensions.get("resourceGroup"),
+                "oci.compartment_id": oci_dimensions.get("compartmentId"),
+            }
+        if enricher := get_enricher():
+            dimensions.update(enricher.enrich(oci_dimensions))
 
         buckets = create_minutely_buckets(datapoints)
         aggregated = {}
@@ -41,82 +84,228 @@ def process_metrics(body: Dict):
             )
 
         for timestamp, summary_stat in aggregated.items():
-            mint_metric = MintMetric(
+            metric_point = MetricPoint(
                 key,
                 summary_stat,
-                {
-                    "oci.resource_group": oci_dimensions.get("resourceGroup"),
-                    "oci.compartment_id": oci_dimensions.get("compartmentId"),
-                },
+                dimensions,
                 timestamp * 1000,
             )
-            logging.getLogger().info(f"mint_metric: {mint_metric}")
-            push_metrics_to_dynatrace(mint_metric)
+            logging.getLogger().info(f"metric_point: {metric_point}")
+            metric_points.append(metric_point)
     else:
         metric_map = namespace_map.get(namespace)
         if metric_map is None:
             logging.getLogger().error(
                 f"Could not find a metric mapping for namespace '{namespace}'"
             )
-            return
+            return metric_points
         if value_or_none := metric_map.value_from_oci_metric_name(
             metric_name, oci_dimensions, datapoints
         ):
             dynatrace_metric_key, results = value_or_none
-            dimensions = metric_map.dimensions(oci_dimensions)
+            dimensions = metric_map.dimensions(oci_dimensions, get_enricher())
 
             for result in results:
-                mint_metric = MintMetric(
+                metric_point = MetricPoint(
                     dynatrace_metric_key,
                     result.value,
                     dimensions,
                     result.timestamp * 1000,
                 )
-            logging.getLogger().info(f"process_metrics: Mint Metric: {mint_metric}")
-            push_metrics_to_dynatrace(mint_metric)
+                logging.getLogger().info(f"process_metrics: Metric Point: {metric_point}")
+                metric_points.append(metric_point)
         else:
             logging.getLogger().debug(
                 f"Could not find a mapping for metric '{metric_name}' in namespace '{namespace}'"
             )
-            return
+    return metric_points
 
 METRIC_INGEST_ENDPOINT = "/api/v2/metrics/ingest"
 
 
-def push_metrics_to_dynatrace(mint_metric: MintMetric):
+# The sink is kept for the lifetime of the container so OAuth tokens are reused between invocations
+_metric_sink: Optional[MetricSink] = None
+
+
+def get_metric_sink() -> MetricSink:
+    global _metric_sink
+    if _metric_sink is None:
+        _metric_sink = create_metric_sink()
+    return _metric_sink
+
+
+# Sends a batch serialized by process_events through the configured sink
+def push_metrics_to_dynatrace(serialized):
     try:
-        tenant_url = os.environ["DYNATRACE_TENANT"]
-        # Remove the trailing slash if it exits
-        if tenant_url.endswith("/"):
-            tenant_url = tenant_url[:-1]
-        client = DynatraceClient(tenant_url)
-
-        auth_method = os.environ["AUTH_METHOD"]
-        if auth_method == "oauth":
-            client_id = os.environ["OAUTH_CLIENT_ID"]
-            client_secret = os.environ["OAUTH_CLIENT_SECRET"]
-            account_urn = os.environ["OAUTH_ACCOUNT_URN"]
-            client.using_oauth(client_id, client_secret, account_urn)
-        elif auth_method == "token":
-            api_token = os.environ["DYNATRACE_API_KEY"]
-            client.using_api_token(api_token)
+        get_metric_sink().send_serialized(serialized)
+    except (Exception, ValueError) as ex:
+        logging.getLogger().error(str(ex))
+
+
+# Maps, aggregates and serializes a list of CloudEvents. Worker processes get the names the parent process
+# prefetched for their partition instead of calling the resolver themselves.
+def serialize_events(events: List[Dict], names: Optional[Dict[str, Optional[str]]] = None):
+    enricher = get_enricher()
+    if enricher is not None:
+        if names is None:
+            enricher.prefetch(events)
         else:
-            logging.getLogger().error(
-                f"Invalid authentication method '{auth_method}'. Expected either 'oauth' or 'token'"
+            enricher.cache.put_all(names)
+
+    metric_points: List[MetricPoint] = []
+    for event in events:
+        # A malformed event is skipped so it does not take the rest of the batch with it
+        try:
+            metric_points.extend(process_metrics(event))
+        except Exception as ex:
+            logging.getLogger().error(f"Skipping event that could not be processed: {ex}: {event}")
+
+    if enricher is not None and names is None:
+        logging.getLogger().info(f"Enrichment cache: {enricher.cache.stats()}")
+
+    # Points the ingest API would reject are dropped before they are serialized
+    clock_skew_ms = int(float(os.environ.get("VALIDATION_CLOCK_SKEW_SECONDS", "60")) * 1000)
+    metric_points, counters = validate_points(metric_points, clock_skew_ms)
+    if counters:
+        logging.getLogger().warning(f"Pre-ingest validation: {dict(counters)}")
+
+    sink = get_metric_sink()
+    if quarantine := get_quarantine():
+        metric_points = quarantine.filter_points(metric_points)
+        logging.getLogger().info(f"Quarantine: {quarantine.stats()}")
+    return sink.serialize(metric_points)
+
+
+# Events of the same OCI resource share a partition so their series are aggregated and grouped by one worker
+def series_partition_key(event: Dict):
+    try:
+        return event.get("namespace"), event.get("compartmentId"), frozenset((event.get("dimensions") or {}).items())
+    except (AttributeError, TypeError):
+        # Malformed events are rejected by the worker that processes them
+        return None
+
+
+def parallel_workers() -> int:
+    return int(os.environ.get("PARALLEL_WORKERS", "1"))
+
+
+# Starts the PARALLEL_WORKERS processes up front, for long running processes that start threads of their own
+def start_parallel_workers():
+    get_metric_sink()
+    get_enricher()
+    if parallel_workers() > 1:
+        parallel.start(serialize_events, parallel_workers())
+
+
+# Large batches are split between PARALLEL_WORKERS processes when they contain at least
+# PARALLEL_EVENT_THRESHOLD events, smaller batches are processed in the function's own process
+def process_events(events: List[Dict]):
+    # Created before the pool is forked so configuration errors surface here and workers inherit them
+    sink = get_metric_sink()
+    enricher = get_enricher()
+    workers = parallel_workers()
+    threshold = int(os.environ.get("PARALLEL_EVENT_THRESHOLD", "5000"))
+    if workers > 1 and len(events) >= threshold:
+        # Names are resolved once for the whole batch, in this process's cache
+        names = None
+        if enricher is not None:
+            enricher.prefetch(events)
+            logging.getLogger().info(f"Enrichment cache: {enricher.cache.stats()}")
+            names = enricher.cached_names
+        try:
+            batches = parallel.map_partitions(serialize_events, events, workers, series_partition_key, names)
+            return sink.merge(batches)
+        except (OSError, BrokenProcessPool) as ex:
+            logging.getLogger().warning(f"Could not process events in parallel, falling back to a single process: {ex}")
+            parallel.shutdown()
+    return serialize_events(events)
+
+
+# OUTPUT_FORMAT selects how metrics are sent, either as MINT lines (default) or as OTLP over HTTP
+def create_metric_sink() -> MetricSink:
+    client = create_dynatrace_client()
+    output_format = os.environ.get("OUTPUT_FORMAT", "mint").lower()
+    if output_format == "mint":
+        return MintSink(client)
+    if output_format == "otlp":
+        # Only imported when used so the protobuf dependency is not loaded for MINT output
+        from otlp import OtlpSink, SUMMARY_MODE_GAUGE
+
+        return OtlpSink(client, os.environ.get("OTLP_SUMMARY_MODE", SUMMARY_MODE_GAUGE).lower())
+    raise ValueError(f"Invalid output format '{output_format}'. Expected either 'mint' or 'otlp'")
+
+
+# Series the ingest API rejected are quarantined for QUARANTINE_TTL_SECONDS, doubling every time they are
+# rejected again up to QUARANTINE_MAX_TTL_SECONDS. Setting QUARANTINE_TTL_SECONDS to 0 disables the quarantine.
+_quarantine: Optional[QuarantineCache] = None
+_quarantine_created = False
+
+
+def get_quarantine() -> Optional[QuarantineCache]:
+    global _quarantine, _quarantine_created
+    if not _quarantine_created:
+        ttl_seconds = float(os.environ.get("QUARANTINE_TTL_SECONDS", "3600"))
+        if ttl_seconds > 0:
+            _quarantine = QuarantineCache(
+                int(os.environ.get("QUARANTINE_SIZE", "10000")),
+                ttl_seconds,
+                float(os.environ.get("QUARANTINE_MAX_TTL_SECONDS", "86400")),
             )
+        _quarantine_created = True
+    return _quarantine
 
-        proxy_url = create_proxy_connection()
-        proxies = {"http": proxy_url, "https": proxy_url} if proxy_url else None
-        logging.getLogger().info(f"Using proxies: {proxies}")
-        client.send_mint_metric(str(mint_metric), proxies)
-    except (Exception, ValueError) as ex:
-        logging.getLogger().error(str(ex))
+
+# Destinations are read from DYNATRACE_DESTINATIONS, a JSON list of objects using the same keys as the
+# single destination configuration. Without it the top level configuration is used as the only destination.
+def create_dynatrace_client() -> DynatraceClient:
+    destinations = os.environ.get("DYNATRACE_DESTINATIONS")
+    settings_list = json.loads(destinations) if destinations else [os.environ]
+
+    client = DynatraceClient(quarantine=get_quarantine())
+    for settings in settings_list:
+        add_destination(client, settings)
+    if not client.destinations:
+        raise ValueError("No valid Dynatrace destination is configured")
+    return client
+
+
+def add_destination(client: DynatraceClient, settings: Mapping[str, str]):
+    tenant_url = settings["DYNATRACE_TENANT"]
+    # Remove the trailing slash if it exits
+    if tenant_url.endswith("/"):
+        tenant_url = tenant_url[:-1]
+
+    proxy_url = create_proxy_connection(settings)
+    proxies = {"http": proxy_url, "https": proxy_url} if proxy_url else None
+    logging.getLogger().info(f"Using proxies for '{tenant_url}': {proxies}")
+
+    metric_filter = settings.get("METRIC_FILTER") or []
+    if isinstance(metric_filter, str):
+        metric_filter = [prefix.strip() for prefix in metric_filter.split(",") if prefix.strip()]
+
+    auth_method = settings["AUTH_METHOD"]
+    if auth_method == "oauth":
+        client_id = settings["OAUTH_CLIENT_ID"]
+        client_secret = settings["OAUTH_CLIENT_SECRET"]
+        account_urn = settings["OAUTH_ACCOUNT_URN"]
+        base_client = OAuthClient(tenant_url, client_id, client_secret, account_urn)
+    elif auth_method == "token":
+        api_token = settings["DYNATRACE_API_KEY"]
+        base_client = ApiClient(tenant_url, api_token)
+    else:
+        logging.getLogger().error(
+            f"Invalid authentication method '{auth_method}'. Expected either 'oauth' or 'token'"
+        )
+        return
+
+    name = settings.get("NAME") or tenant_url
+    client.add_destination(Destination(name, base_client, proxies, metric_filter))
 
 
-def create_proxy_connection() -> Optional[Dict[str, str]]:
-    proxy_address = os.environ.get("PROXY_URL", None)
-    proxy_username = os.environ.get("PROXY_USERNAME", None)
-    proxy_password = os.environ.get("PROXY_PASSWORD", None)
+def create_proxy_connection(settings: Mapping[str, str] = os.environ) -> Optional[str]:
+    proxy_address = settings.get("PROXY_URL", None)
+    proxy_username = settings.get("PROXY_USERNAME", None)
+    proxy_password = settings.get("PROXY_PASSWORD", None)
 
     if proxy_address is None:
         return None
@@ -152,10 +341,10 @@ def handler(ctx, data: io.BytesIO = None):
         body = json.loads(data.getvalue())
         if isinstance(body, list):
             # Batch of CloudEvents format
-            for b in body:
-                process_metrics(b)
+            events = body
         else:
             # Single CloudEvent
-            process_metrics(body)
+            events = [body]
+        push_metrics_to_dynatrace(process_events(events))
     except (Exception, ValueError) as ex:
         logging.getLogger().error(str(ex))
@@ -7,6 +7,7 @@ from aggregation import (
     aggregate_sum,
     aggregate_min,
 )
+from enrichment import Enricher
 
 @dataclass
 class DynatraceToOCIMetric:
@@ -26,13 +27,16 @@ class MetricMapping:
         self.constant_dimension_map = constant_dimension_map
 
     # Given the list of OCI dimensions, this function maps the dimension keys to Dynatrace dimensions
-    def dimensions(self, oci_dimensions: Dict[str, str]) -> Dict[str, str]:
+    # and, if an enricher is given, adds the names of the compartment and resource
+    def dimensions(self, oci_dimensions: Dict[str, str], enricher: Optional[Enricher] = None) -> Dict[str, str]:
         dimensions = self.constant_dimension_map.copy()
         for key, value in oci_dimensions.items():
             dynatrace_dimension_keys = self.dimension_map.get(key)
             if dynatrace_dimension_keys:
                 for dynatrace_dimension_key in dynatrace_dimension_keys:
                     dimensions[dynatrace_dimension_key] = value
+        if enricher is not None:
+            dimensions.update(enricher.enrich(oci_dimensions))
         return dimensions
 
     # Given the oci metric name and the list of datapoints, this function returns the dynatrace metric name and the aggregated value
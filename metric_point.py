@@ -0,0 +1,13 @@
+from dataclasses import dataclass, field
+from typing import Dict, Union
+from summary_stat import SummaryStat
+
+
+# A single aggregated datapoint, independent of the format it will be sent in
+@dataclass
+class MetricPoint:
+    key: str
+    value: Union[float, SummaryStat]
+    dimensions: Dict[str, str] = field(default_factory=dict)
+    # Unix timestamp in milliseconds
+    timestamp: int = 0
@@ -1,17 +1,45 @@
 from datetime import datetime
+from functools import lru_cache
 from summary_stat import SummaryStat
-from typing import Dict, Optional, Union
+from typing import Dict, Optional, Tuple, Union
+
+SERIES_PREFIX_CACHE_SIZE = 16384
+
+
+def _escape_dimension_value(value) -> str:
+    value = str(value)
+    if '"' in value or "\\" in value or "\n" in value:
+        value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return value
+
+
+# Cache key of a series' dimensions. Values are written as strings anyway, converting them first keeps
+# unhashable values such as lists from failing the lookup.
+def dimension_items(dimensions: Optional[Dict[str, str]]) -> Tuple[Tuple[str, str], ...]:
+    if not dimensions:
+        return ()
+    return tuple((k, v if isinstance(v, str) else str(v)) for k, v in dimensions.items())
+
+
+# The metric key and dimensions of a series only need to be formatted once, repeated series reuse the prefix
+@lru_cache(maxsize=SERIES_PREFIX_CACHE_SIZE)
+def series_prefix(key: str, dimensions: Tuple[Tuple[str, str], ...]) -> str:
+    dimensions_string = ",".join(
+        [f'{k.lower()}="{_escape_dimension_value(v)}"' for k, v in dimensions]
+    )
+    return f"{key}{',' if dimensions_string else ''}{dimensions_string}"
+
 
 class MintMetric(str):
     def __new__(cls, key: str, value: Union[float, SummaryStat], dimensions: Dict[str, str] | None = None, time: Optional[int] = None):
-        if dimensions is None:
-            dimensions = {}
-        dimensions_string = ",".join(
-            [f'{k.lower()}="{v}"' for k, v in dimensions.items()]
-        )
+        prefix = series_prefix(key, dimension_items(dimensions))
         timestamp = int(datetime.now().timestamp() * 1000)
         if time is not None:
             timestamp = time
         return super().__new__(
-            cls, f"{key}{',' if dimensions_string else ''}{dimensions_string} gauge,{value} {timestamp}"
-        )
\ No newline at end of file
+            cls, f"{prefix} gauge,{value} {timestamp}"
+        )
+
+    # Unpickled as a plain string, the constructor arguments are not kept
+    def __reduce__(self):
+        return (str, (str(self),))
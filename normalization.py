@@ -0,0 +1,28 @@
+import re
+from functools import lru_cache
+
+MAX_METRIC_KEY_LENGTH = 250
+MAX_DIMENSION_KEY_LENGTH = 100
+NORMALIZATION_CACHE_SIZE = 4096
+
+_CAMEL_CASE_BOUNDARY = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+_INVALID_METRIC_KEY_CHARACTERS = re.compile(r"[^A-Za-z0-9_.-]")
+_INVALID_DIMENSION_KEY_CHARACTERS = re.compile(r"[^a-z0-9_.:-]")
+
+
+# OCI metric names are kept as is, only characters the ingest API does not accept are replaced.
+# Ex: ("oci_computeagent", "CpuUtilization") -> "cloud.oci.computeagent.CpuUtilization"
+@lru_cache(maxsize=NORMALIZATION_CACHE_SIZE)
+def normalize_metric_key(namespace: str, metric_name: str) -> str:
+    key_namespace = namespace.replace("oci_", "")
+    key = f"cloud.oci.{key_namespace}.{metric_name}"
+    return _INVALID_METRIC_KEY_CHARACTERS.sub("_", key)[:MAX_METRIC_KEY_LENGTH]
+
+
+# OCI dimension names are camel case, they are converted to the snake case keys used by the extension.
+# Ex: "resourceDisplayName" -> "oci.resource_display_name"
+@lru_cache(maxsize=NORMALIZATION_CACHE_SIZE)
+def normalize_dimension_key(oci_dimension: str) -> str:
+    key = _CAMEL_CASE_BOUNDARY.sub("_", oci_dimension).lower()
+    key = _INVALID_DIMENSION_KEY_CHARACTERS.sub("_", key)
+    return f"oci.{key}"[:MAX_DIMENSION_KEY_LENGTH]
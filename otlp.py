@@ -0,0 +1,194 @@
+import logging
+from typing import Dict, List, Tuple
+from opentelemetry.proto.collector.metrics.v1.metrics_service_pb2 import ExportMetricsServiceRequest
+from opentelemetry.proto.common.v1.common_pb2 import KeyValue
+from opentelemetry.proto.metrics.v1.metrics_pb2 import Metric, ResourceMetrics
+from dynatrace_client import Destination, DynatraceClient
+from metric_point import MetricPoint
+from sink import MetricSink
+from summary_stat import SummaryStat
+
+SCOPE_NAME = "oci-metric-ingestion"
+# Keep every request comfortably below the ingest API's payload limit
+MAX_REQUEST_BYTES = 1_000_000
+# OCI metrics are aggregated into minutely buckets
+AGGREGATION_INTERVAL_NANOS = 60 * 1_000_000_000
+
+# Dimensions describing the OCI resource that emitted a metric, these are sent once per resource
+# instead of being repeated on every datapoint
+RESOURCE_DIMENSIONS = {
+    "cloud.provider",
+    "oci.service",
+    "oci.availability_domain",
+    "oci.compartment_id",
+    "oci.compartment_name",
+    "oci.fault_domain",
+    "oci.region",
+    "oci.resource_display_name",
+    "oci.resource_group",
+    "oci.resource_id",
+    "oci.resource_name",
+    "oci.resource_type",
+    "oci.tenancy_id",
+    "oci.tenancy_name",
+}
+
+SUMMARY_MODE_SUMMARY = "summary"
+SUMMARY_MODE_GAUGE = "gauge"
+
+
+def _key_values(attributes: Tuple[Tuple[str, str], ...]) -> List[KeyValue]:
+    key_values = []
+    for key, value in attributes:
+        key_value = KeyValue(key=key)
+        key_value.value.string_value = str(value)
+        key_values.append(key_value)
+    return key_values
+
+
+def _split_dimensions(dimensions: Dict[str, str]) -> Tuple[Tuple[Tuple[str, str], ...], Tuple[Tuple[str, str], ...]]:
+    resource = []
+    attributes = []
+    for key, value in dimensions.items():
+        if value is None:
+            continue
+        # Resources are grouped by their dimensions, values that are not hashable are grouped by their string
+        if key in RESOURCE_DIMENSIONS:
+            resource.append((key, value if isinstance(value, str) else str(value)))
+        else:
+            attributes.append((key, value))
+    return tuple(sorted(resource)), tuple(attributes)
+
+
+def _add_datapoint(metric: Metric, point: MetricPoint, attributes: Tuple[Tuple[str, str], ...], summary_mode: str):
+    time_unix_nano = point.timestamp * 1_000_000
+    value = point.value
+    if isinstance(value, SummaryStat) and summary_mode == SUMMARY_MODE_SUMMARY:
+        datapoint = metric.summary.data_points.add()
+        datapoint.start_time_unix_nano = time_unix_nano - AGGREGATION_INTERVAL_NANOS
+        datapoint.count = int(value.value_count)
+        datapoint.sum = value.value_sum
+        # min and max are represented as the 0 and 1 quantiles
+        datapoint.quantile_values.add(quantile=0.0, value=value.value_min)
+        datapoint.quantile_values.add(quantile=1.0, value=value.value_max)
+    else:
+        if isinstance(value, SummaryStat):
+            value = value.value_sum / value.value_count if value.value_count else 0.0
+        datapoint = metric.gauge.data_points.add()
+        datapoint.as_double = float(value)
+    datapoint.time_unix_nano = time_unix_nano
+    datapoint.attributes.extend(_key_values(attributes))
+
+
+# Groups points by resource and metric key so repeated dimensions are only encoded once per resource
+def encode_otlp(points: List[MetricPoint], summary_mode: str = SUMMARY_MODE_GAUGE) -> bytes:
+    resources: Dict[Tuple[Tuple[str, str], ...], Dict[str, Metric]] = {}
+    for point in points:
+        resource, attributes = _split_dimensions(point.dimensions)
+        metrics = resources.setdefault(resource, {})
+        metric = metrics.get(point.key)
+        if metric is None:
+            metric = metrics[point.key] = Metric(name=point.key)
+        _add_datapoint(metric, point, attributes, summary_mode)
+
+    request = ExportMetricsServiceRequest()
+    for resource, metrics in resources.items():
+        resource_metrics: ResourceMetrics = request.resource_metrics.add()
+        resource_metrics.resource.attributes.extend(_key_values(resource))
+        scope_metrics = resource_metrics.scope_metrics.add()
+        scope_metrics.scope.name = SCOPE_NAME
+        scope_metrics.metrics.extend(metrics.values())
+    return request.SerializeToString()
+
+
+# Removes the metrics a destination does not accept from a serialized request
+def filter_otlp(payload: bytes, destination: Destination) -> bytes:
+    request = ExportMetricsServiceRequest.FromString(payload)
+    filtered = ExportMetricsServiceRequest()
+    for resource_metrics in request.resource_metrics:
+        kept_resource_metrics = None
+        for scope_metrics in resource_metrics.scope_metrics:
+            metrics = [metric for metric in scope_metrics.metrics if destination.accepts(metric.name)]
+            if not metrics:
+                continue
+            if kept_resource_metrics is None:
+                kept_resource_metrics = filtered.resource_metrics.add()
+                kept_resource_metrics.resource.CopyFrom(resource_metrics.resource)
+            kept_scope_metrics = kept_resource_metrics.scope_metrics.add()
+            kept_scope_metrics.scope.CopyFrom(scope_metrics.scope)
+            kept_scope_metrics.metrics.extend(metrics)
+    return filtered.SerializeToString()
+
+
+def _split_resource_metrics(resource_metrics: ResourceMetrics, max_bytes: int) -> List[ResourceMetrics]:
+    if resource_metrics.ByteSize() <= max_bytes:
+        return [resource_metrics]
+    # A single resource above the budget is split by metric, repeating its resource attributes
+    parts = []
+    part = None
+    for scope_metrics in resource_metrics.scope_metrics:
+        for metric in scope_metrics.metrics:
+            if part is None or part.ByteSize() + metric.ByteSize() > max_bytes:
+                part = ResourceMetrics()
+                part.resource.CopyFrom(resource_metrics.resource)
+                parts.append(part)
+            if not part.scope_metrics or part.scope_metrics[-1].scope != scope_metrics.scope:
+                part.scope_metrics.add().scope.CopyFrom(scope_metrics.scope)
+            part.scope_metrics[-1].metrics.append(metric)
+    return parts
+
+
+# Splits a serialized request into requests of at most max_bytes, grouped by resource. A single metric
+# larger than the budget is still sent on its own.
+def split_otlp(payload: bytes, max_bytes: int = MAX_REQUEST_BYTES) -> List[bytes]:
+    if len(payload) <= max_bytes:
+        return [payload]
+    request = ExportMetricsServiceRequest.FromString(payload)
+    requests: List[bytes] = []
+    current = ExportMetricsServiceRequest()
+    for resource_metrics in request.resource_metrics:
+        for part in _split_resource_metrics(resource_metrics, max_bytes):
+            # Each repeated field adds a tag and a length prefix to the encoded size
+            size = part.ByteSize() + 8
+            if current.resource_metrics and current.ByteSize() + size > max_bytes:
+                requests.append(current.SerializeToString())
+                current = ExportMetricsServiceRequest()
+            current.resource_metrics.append(part)
+    if current.resource_metrics:
+        requests.append(current.SerializeToString())
+    return requests
+
+
+class OtlpSink(MetricSink[bytes]):
+    def __init__(self, client: DynatraceClient, summary_mode: str = SUMMARY_MODE_GAUGE):
+        if summary_mode not in (SUMMARY_MODE_SUMMARY, SUMMARY_MODE_GAUGE):
+            raise ValueError(
+                f"Invalid OTLP summary mode '{summary_mode}'. Expected either '{SUMMARY_MODE_SUMMARY}' or '{SUMMARY_MODE_GAUGE}'"
+            )
+        self._client = client
+        self._summary_mode = summary_mode
+
+    def serialize(self, points: List[MetricPoint]) -> bytes:
+        return encode_otlp(points, self._summary_mode)
+
+    # Concatenated protobuf messages parse as a single message with the repeated fields appended
+    def merge(self, batches: List[bytes]) -> bytes:
+        return b"".join(batches)
+
+    def send_serialized(self, serialized: bytes) -> Dict[str, bool]:
+        if not serialized:
+            return {}
+        logging.getLogger().info(f"Sending {len(serialized)} bytes of OTLP metrics")
+
+        def send_to(destination: Destination) -> bool:
+            payload = serialized
+            if destination.metric_filter:
+                payload = filter_otlp(serialized, destination)
+                if not payload:
+                    return True
+            success = True
+            for request in split_otlp(payload):
+                success = destination.client.send_otlp_metrics(request, destination.proxies) and success
+            return success
+
+        return self._client.fan_out(send_to)
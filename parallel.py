@@ -0,0 +1,96 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+import threading
+from typing import Callable, Dict, Hashable, List, Optional
+
+# The pool is kept for the lifetime of the container, only the first large invocation pays for starting it
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_function: Optional[Callable] = None
+_executor_workers = 0
+# Set by start, the pool is then never forked again because other threads may be holding locks
+_started_early = False
+_lock = threading.Lock()
+
+# Set in every worker process by the pool initializer
+_partition_function: Optional[Callable] = None
+
+
+def _initialize_worker(function: Callable):
+    global _partition_function
+    _partition_function = function
+
+
+def _run_partition(args: tuple):
+    return _partition_function(*args)
+
+
+# Events with the same key always end up in the same partition so a series is never split between workers
+def partition_events(events: List[Dict], partitions: int, key: Callable[[Dict], Hashable]) -> List[List[Dict]]:
+    result: List[List[Dict]] = [[] for _ in range(partitions)]
+    for event in events:
+        result[hash(key(event)) % partitions].append(event)
+    return [partition for partition in result if partition]
+
+
+def _get_executor(function: Callable, workers: int) -> ProcessPoolExecutor:
+    global _executor, _executor_function, _executor_workers
+    if _executor is None or _executor_function is not function or _executor_workers != workers:
+        if _started_early:
+            raise BrokenProcessPool("The process pool was started before other threads and cannot be restarted")
+        _shutdown()
+        logging.getLogger().info(f"Starting process pool with {workers} workers")
+        # Workers are forked so the function is inherited instead of pickled, the fn runtime loads
+        # func.py outside of sys.modules which means its functions cannot be pickled by reference
+        _executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=get_context("fork"),
+            initializer=_initialize_worker,
+            initargs=(function,),
+        )
+        _executor_function = function
+        _executor_workers = workers
+    return _executor
+
+
+# Runs function on partitions of the events in a pool of worker processes and returns the result of each partition.
+# When extra is set, extra(partition) is computed in the calling process and passed as a second argument.
+def map_partitions(
+    function: Callable[..., object],
+    events: List[Dict],
+    workers: int,
+    key: Callable[[Dict], Hashable],
+    extra: Optional[Callable[[List[Dict]], object]] = None,
+) -> List[object]:
+    with _lock:
+        executor = _get_executor(function, workers)
+    partitions = partition_events(events, workers, key)
+    tasks = [(partition,) if extra is None else (partition, extra(partition)) for partition in partitions]
+    return list(executor.map(_run_partition, tasks))
+
+
+# Forks all workers right away, must be called before the process starts any other thread: a child forked
+# while another thread holds a lock (logging, connection pools, ...) would block on it forever.
+# map_partitions raises BrokenProcessPool instead of starting a new pool afterwards.
+def start(function: Callable[..., object], workers: int):
+    global _started_early
+    with _lock:
+        executor = _get_executor(function, workers)
+        # Forked workers are only launched by the first submitted task
+        executor.submit(int).result()
+        _started_early = True
+
+
+def shutdown():
+    with _lock:
+        _shutdown()
+
+
+def _shutdown():
+    global _executor, _executor_function, _executor_workers
+    if _executor is not None:
+        _executor.shutdown()
+    _executor = None
+    _executor_function = None
+    _executor_workers = 0
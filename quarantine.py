@@ -0,0 +1,112 @@
+from collections import Counter, OrderedDict
+import threading
+import time
+from typing import Dict, Iterable, Set, Tuple
+from metric_point import MetricPoint
+from mint import dimension_items, series_prefix
+
+
+# The identity of the series a point belongs to, the same string its MINT line starts with
+def point_series(point: MetricPoint) -> str:
+    return series_prefix(point.key, dimension_items(point.dimensions))
+
+
+# The identity of the series of a MINT line, everything before the payload and timestamp
+def line_series(line: str) -> str:
+    return line.rsplit(" ", 2)[0]
+
+
+class QuarantineCache:
+    # Series rejected by a destination are not sent to it again until their quarantine expires. The first
+    # send after expiry probes the series, if it is rejected again the quarantine time is doubled up to max_ttl_seconds,
+    # if it is accepted the entry is cleared. Entries not probed within ttl_seconds of their expiry are pruned.
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 3600, max_ttl_seconds: float = 86400):
+        self._max_size = max_size
+        self._ttl_seconds = ttl_seconds
+        self._max_ttl_seconds = max_ttl_seconds
+        # (destination, series) -> (expiration, times rejected)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, int]]" = OrderedDict()
+        # Latest expiration per destination, allows skipping the per line check while nothing is quarantined
+        self._active_until: Dict[str, float] = {}
+        # Number of entries per destination, expired ones included
+        self._counts: Counter = Counter()
+        self._destinations: Set[str] = set()
+        self._lock = threading.Lock()
+        self.skipped = 0
+
+    def register_destination(self, destination: str):
+        with self._lock:
+            self._destinations.add(destination)
+
+    def add(self, destination: str, series: Iterable[str]):
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            for entry_series in series:
+                key = (destination, entry_series)
+                _, rejected = self._entries.get(key, (0, 0))
+                if not rejected:
+                    self._counts[destination] += 1
+                ttl = min(self._ttl_seconds * 2 ** rejected, self._max_ttl_seconds)
+                expiration = now + ttl
+                self._entries[key] = (expiration, rejected + 1)
+                self._entries.move_to_end(key)
+                self._active_until[destination] = max(self._active_until.get(destination, 0), expiration)
+            while len(self._entries) > self._max_size:
+                self._remove(next(iter(self._entries)))
+
+    # Forgets the series a destination accepted again
+    def clear(self, destination: str, series: Iterable[str]):
+        with self._lock:
+            for entry_series in series:
+                if (destination, entry_series) in self._entries:
+                    self._remove((destination, entry_series))
+
+    def _remove(self, key: Tuple[str, str]):
+        del self._entries[key]
+        self._counts[key[0]] -= 1
+        if not self._counts[key[0]]:
+            del self._counts[key[0]]
+
+    def _prune(self, now: float):
+        expired = [key for key, (expiration, _) in self._entries.items() if expiration + self._ttl_seconds <= now]
+        for key in expired:
+            self._remove(key)
+
+    # Whether the destination has any entries, expired ones included, i.e. whether its lines need to be checked
+    def has_entries(self, destination: str) -> bool:
+        return self._counts.get(destination, 0) > 0
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        return key in self._entries
+
+    def is_active(self, destination: str) -> bool:
+        return self._active_until.get(destination, 0) > time.monotonic()
+
+    def is_quarantined(self, destination: str, series: str) -> bool:
+        entry = self._entries.get((destination, series))
+        return entry is not None and entry[0] > time.monotonic()
+
+    # A series is only skipped before serialization if every destination rejects it
+    def is_quarantined_everywhere(self, series: str) -> bool:
+        if not self._destinations:
+            return False
+        return all(self.is_quarantined(destination, series) for destination in self._destinations)
+
+    def filter_points(self, points: Iterable[MetricPoint]) -> list:
+        if not any(self.is_active(destination) for destination in self._destinations):
+            return list(points)
+        kept = []
+        for point in points:
+            if self.is_quarantined_everywhere(point_series(point)):
+                self.skipped += 1
+            else:
+                kept.append(point)
+        return kept
+
+    def stats(self) -> Dict[str, int]:
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            active = sum(1 for expiration, _ in self._entries.values() if expiration > now)
+            return {"size": len(self._entries), "active": active, "skipped": self.skipped}
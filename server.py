@@ -0,0 +1,289 @@
+"""Standalone ingest server that runs the function's pipeline outside of OCI Functions.
+
+CloudEvents are accepted over HTTP (the same JSON body the function receives, a single event or a list) and/or
+read from JSONL files in a directory. Events are buffered in a bounded queue and processed in batches by worker
+threads, a batch is flushed when it reaches the batch size or when the linger time has passed.
+The function's configuration (DYNATRACE_TENANT, AUTH_METHOD, ...) is read from the environment.
+
+Usage: python server.py [--port N] [--directory PATH] [--workers N] [--batch-size N] [--linger SECONDS]
+"""
+import argparse
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from typing import Dict, List, Optional
+
+os.environ.setdefault("IMPORT_ALL_METRICS", "False")
+os.environ.setdefault("LOG_LEVEL", "INFO")
+
+import func
+import parallel
+
+
+class EventQueue:
+    # Holds at most capacity events, producers wait for space so a slow destination slows down intake
+    # instead of growing memory without bounds
+    def __init__(self, capacity: int):
+        self._capacity = capacity
+        self._events: deque = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def __len__(self):
+        with self._condition:
+            return len(self._events)
+
+    # Adds all events or none of them. Returns False if there was no space before the timeout or the
+    # queue is closed. A timeout of None waits until there is space.
+    def put(self, events: List[Dict], timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            # A batch larger than the capacity is accepted once the queue is empty so it can never block forever
+            while not self._closed and self._events and len(self._events) + len(events) > self._capacity:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            if self._closed:
+                return False
+            self._events.extend(events)
+            self._condition.notify_all()
+            return True
+
+    # Waits for the first event, then for up to linger seconds for the batch to fill up.
+    # Returns an empty list only once the queue is closed and drained.
+    def get_batch(self, max_events: int, linger: float) -> List[Dict]:
+        with self._condition:
+            while True:
+                while not self._events and not self._closed:
+                    self._condition.wait()
+                deadline = time.monotonic() + linger
+                while self._events and len(self._events) < max_events and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                # Another worker may have taken the events while this one was lingering
+                if self._events or self._closed:
+                    break
+            batch = [self._events.popleft() for _ in range(min(max_events, len(self._events)))]
+            self._condition.notify_all()
+            return batch
+
+    # Stops accepting events, events already queued are still returned by get_batch
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class IngestServer:
+    def __init__(self, queue_size: int, batch_size: int, linger: float, workers: int, enqueue_timeout: float):
+        self.queue = EventQueue(queue_size)
+        self._batch_size = batch_size
+        self._linger = linger
+        self._enqueue_timeout = enqueue_timeout
+        self._workers = [
+            threading.Thread(target=self._work, name=f"ingest-worker-{i}") for i in range(workers)
+        ]
+        self._stats_lock = threading.Lock()
+        self.stats = {"accepted": 0, "rejected": 0, "processed": 0, "batches": 0, "failed_batches": 0}
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+
+    def _count(self, name: str, value: int = 1):
+        with self._stats_lock:
+            self.stats[name] += value
+
+    # Returns False when the queue stayed full for the enqueue timeout
+    def submit(self, events: List[Dict], timeout: Optional[float] = -1) -> bool:
+        if timeout == -1:
+            timeout = self._enqueue_timeout
+        if self.queue.put(events, timeout):
+            self._count("accepted", len(events))
+            return True
+        self._count("rejected", len(events))
+        return False
+
+    def _work(self):
+        while True:
+            batch = self.queue.get_batch(self._batch_size, self._linger)
+            if not batch:
+                return
+            try:
+                func.push_metrics_to_dynatrace(func.process_events(batch))
+                self._count("processed", len(batch))
+                self._count("batches")
+            except Exception as e:
+                logging.getLogger().error(f"Error processing a batch of {len(batch)} events: {e}")
+                self._count("failed_batches")
+
+    # Stops intake and waits until every queued event has been processed
+    def drain(self):
+        self.queue.close()
+        for worker in self._workers:
+            worker.join()
+
+
+# Raises ValueError for anything that is not a CloudEvent object or a list of them, so a malformed request is
+# rejected before it is acknowledged
+def parse_events(body) -> List[Dict]:
+    # Same formats as the function: a batch of CloudEvents or a single CloudEvent
+    events = body if isinstance(body, list) else [body]
+    for index, event in enumerate(events):
+        if not isinstance(event, dict):
+            raise ValueError(f"event {index} is not an object")
+    return events
+
+
+def create_request_handler(ingest_server: IngestServer):
+    class RequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/health":
+                self._respond(404, {"error": "Not found"})
+                return
+            self._respond(200, {**ingest_server.stats, "queued": len(ingest_server.queue)})
+
+        def do_POST(self):
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                events = parse_events(json.loads(self.rfile.read(length)))
+            except ValueError as e:
+                self._respond(400, {"error": f"Invalid CloudEvent JSON: {e}"})
+                return
+            if ingest_server.submit(events):
+                self._respond(202, {"accepted": len(events)})
+            else:
+                self._respond(503, {"error": "Queue is full"}, {"Retry-After": "1"})
+
+        def _respond(self, status: int, body: Dict, headers: Optional[Dict[str, str]] = None):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            logging.getLogger().debug(format % args)
+
+    return RequestHandler
+
+
+# Queues the events of a JSONL file, one CloudEvent (or list of CloudEvents) per line. Bytes that are not valid
+# UTF-8 are replaced so they only invalidate their own line.
+def read_file(ingest_server: IngestServer, path: str):
+    with open(path, "r", encoding="utf-8", errors="replace") as file:
+        for number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                events = parse_events(json.loads(line))
+            except ValueError as e:
+                logging.getLogger().error(f"Skipping invalid line {number} of '{path}': {e}")
+                continue
+            # Files are read no faster than the events can be processed
+            ingest_server.submit(events, timeout=None)
+
+
+# Reads every *.jsonl file in the directory and renames it to *.jsonl.processed once all of its events are queued.
+# A file that cannot be read is renamed to *.jsonl.failed so the events queued from it are not sent again.
+def read_directory(ingest_server: IngestServer, directory: str, poll_interval: float, stop: threading.Event, once: bool):
+    while not stop.is_set():
+        try:
+            names = sorted(os.listdir(directory))
+        except OSError as e:
+            logging.getLogger().error(f"Could not list '{directory}': {e}")
+            names = []
+        for name in names:
+            if stop.is_set():
+                return
+            if not name.endswith(".jsonl"):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                read_file(ingest_server, path)
+                suffix = "processed"
+                logging.getLogger().info(f"Queued the events of '{path}'")
+            except Exception as e:
+                suffix = "failed"
+                logging.getLogger().error(f"Could not read '{path}', moving it to '{path}.failed': {e}")
+            try:
+                os.rename(path, f"{path}.{suffix}")
+            except OSError as e:
+                logging.getLogger().error(f"Could not rename '{path}': {e}")
+        if once:
+            return
+        stop.wait(poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=os.environ.get("SERVER_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("SERVER_PORT", "8080")), help="0 disables the HTTP listener")
+    parser.add_argument("--directory", default=os.environ.get("SERVER_DIRECTORY"), help="Directory to read *.jsonl files from")
+    parser.add_argument("--poll-interval", type=float, default=float(os.environ.get("SERVER_POLL_INTERVAL", "5")))
+    parser.add_argument("--once", action="store_true", help="Exit after the files in the directory have been processed")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("SERVER_WORKERS", "4")))
+    parser.add_argument("--queue-size", type=int, default=int(os.environ.get("SERVER_QUEUE_SIZE", "100000")))
+    parser.add_argument("--batch-size", type=int, default=int(os.environ.get("SERVER_BATCH_SIZE", "5000")))
+    parser.add_argument("--linger", type=float, default=float(os.environ.get("SERVER_LINGER_SECONDS", "5")))
+    parser.add_argument("--enqueue-timeout", type=float, default=float(os.environ.get("SERVER_ENQUEUE_TIMEOUT", "5")))
+    args = parser.parse_args()
+    if not args.port and not args.directory:
+        parser.error("Either --port or --directory is required")
+
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(threadName)s %(message)s")
+    logging.getLogger().setLevel(os.environ["LOG_LEVEL"].upper())
+
+    # The process pool is forked before any other thread exists, see parallel.start
+    func.start_parallel_workers()
+    ingest_server = IngestServer(args.queue_size, args.batch_size, args.linger, args.workers, args.enqueue_timeout)
+    ingest_server.start()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    http_server = None
+    if args.port:
+        http_server = ThreadingHTTPServer((args.host, args.port), create_request_handler(ingest_server))
+        threading.Thread(target=http_server.serve_forever, name="http", daemon=True).start()
+        logging.getLogger().info(f"Listening on {args.host}:{args.port}")
+
+    reader = None
+    if args.directory:
+        def read():
+            try:
+                read_directory(ingest_server, args.directory, args.poll_interval, stop, args.once)
+            except Exception as e:
+                logging.getLogger().error(f"Stopped reading '{args.directory}': {e}")
+            finally:
+                if args.once:
+                    stop.set()
+
+        reader = threading.Thread(target=read, name="directory-reader")
+        reader.start()
+
+    stop.wait()
+    logging.getLogger().info("Shutting down, draining queued events")
+    if http_server is not None:
+        http_server.shutdown()
+    if reader is not None:
+        reader.join()
+    ingest_server.drain()
+    parallel.shutdown()
+    logging.getLogger().info(f"Stopped: {ingest_server.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+from abc import abstractmethod, ABC
+import logging
+from typing import Dict, Generic, List, TypeVar
+from dynatrace_client import DynatraceClient
+from metric_point import MetricPoint
+from mint import MintMetric
+
+Serialized = TypeVar("Serialized")
+
+
+class MetricSink(ABC, Generic[Serialized]):
+    # Serializing is kept separate from sending so batches serialized in worker processes can be merged
+    @abstractmethod
+    def serialize(self, points: List[MetricPoint]) -> Serialized:
+        pass
+
+    @abstractmethod
+    def merge(self, batches: List[Serialized]) -> Serialized:
+        pass
+
+    # Sends a serialized batch, returns a map of destination name to success
+    @abstractmethod
+    def send_serialized(self, serialized: Serialized) -> Dict[str, bool]:
+        pass
+
+    def send(self, points: List[MetricPoint]) -> Dict[str, bool]:
+        return self.send_serialized(self.serialize(points))
+
+
+class MintSink(MetricSink[List[MintMetric]]):
+    def __init__(self, client: DynatraceClient):
+        self._client = client
+
+    def serialize(self, points: List[MetricPoint]) -> List[MintMetric]:
+        return [
+            MintMetric(point.key, point.value, point.dimensions, point.timestamp)
+            for point in points
+        ]
+
+    def merge(self, batches: List[List[MintMetric]]) -> List[MintMetric]:
+        return [line for batch in batches for line in batch]
+
+    def send_serialized(self, serialized: List[MintMetric]) -> Dict[str, bool]:
+        logging.getLogger().info(f"Sending {len(serialized)} MINT lines")
+        return self._client.send_mint_lines(serialized)
@@ -0,0 +1,82 @@
+from collections import Counter
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+from metric_point import MetricPoint
+from normalization import MAX_DIMENSION_KEY_LENGTH, MAX_METRIC_KEY_LENGTH
+from summary_stat import SummaryStat
+
+# Limits of the metric ingest API, lines outside of them are rejected by the tenant
+MAX_DIMENSION_VALUE_LENGTH = 250
+MAX_DIMENSIONS = 50
+MAX_TIMESTAMP_AGE_MS = 60 * 60 * 1000
+MAX_TIMESTAMP_FUTURE_MS = 10 * 60 * 1000
+
+
+def _is_finite(value) -> bool:
+    if isinstance(value, SummaryStat):
+        return (
+            math.isfinite(value.value_min)
+            and math.isfinite(value.value_max)
+            and math.isfinite(value.value_sum)
+            and value.value_count > 0
+        )
+    try:
+        return math.isfinite(value)
+    except TypeError:
+        return False
+
+
+def _sanitize_dimensions(dimensions: Dict[str, str], counters: Counter) -> Dict[str, str]:
+    if len(dimensions) > MAX_DIMENSIONS:
+        counters["dimensions_dropped"] += len(dimensions) - MAX_DIMENSIONS
+        dimensions = dict(list(dimensions.items())[:MAX_DIMENSIONS])
+    sanitized = None
+    for key, value in dimensions.items():
+        valid_key = key if len(key) <= MAX_DIMENSION_KEY_LENGTH else key[:MAX_DIMENSION_KEY_LENGTH]
+        valid_value = value
+        if isinstance(value, str) and len(value) > MAX_DIMENSION_VALUE_LENGTH:
+            valid_value = value[:MAX_DIMENSION_VALUE_LENGTH]
+        if valid_key is not key or valid_value is not value:
+            counters["dimensions_truncated"] += 1
+            if sanitized is None:
+                sanitized = dict(dimensions)
+            if valid_key is not key:
+                del sanitized[key]
+            sanitized[valid_key] = valid_value
+    return dimensions if sanitized is None else sanitized
+
+
+# Drops the points the ingest API would reject and truncates over-long dimensions. The accepted timestamp
+# window is narrowed by clock_skew_ms on both sides so points close to the edge are not rejected when the
+# function's clock differs from the tenant's. Returns the valid points and counters of what was changed.
+def validate_points(
+    points: List[MetricPoint], clock_skew_ms: int = 60 * 1000, now_ms: Optional[int] = None
+) -> Tuple[List[MetricPoint], Counter]:
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+    oldest = now_ms - MAX_TIMESTAMP_AGE_MS + clock_skew_ms
+    newest = now_ms + MAX_TIMESTAMP_FUTURE_MS - clock_skew_ms
+
+    counters: Counter = Counter()
+    # Points of the same event share their dimensions, they only need to be checked once
+    sanitized_dimensions: Dict[int, Dict[str, str]] = {}
+    valid = []
+    for point in points:
+        if not oldest <= point.timestamp <= newest:
+            counters["timestamp_out_of_range"] += 1
+            continue
+        if not _is_finite(point.value):
+            counters["non_finite_value"] += 1
+            continue
+        if len(point.key) > MAX_METRIC_KEY_LENGTH:
+            counters["key_too_long"] += 1
+            continue
+
+        dimensions = sanitized_dimensions.get(id(point.dimensions))
+        if dimensions is None:
+            dimensions = sanitized_dimensions[id(point.dimensions)] = _sanitize_dimensions(point.dimensions, counters)
+        if dimensions is not point.dimensions:
+            point = MetricPoint(point.key, point.value, dimensions, point.timestamp)
+        valid.append(point)
+    return valid, counters